@@ -1,17 +1,38 @@
 import os
+import atexit
+import base64
 import time
+import random
 import subprocess
 import threading
+import logging
+import logging.handlers
+import queue
+from collections import namedtuple
 import requests
 import signal
-from flask import Flask, Response, request, render_template_string, redirect, url_for, send_file, make_response
+from requests.adapters import HTTPAdapter
+from flask import Flask, Response, request, redirect, url_for, jsonify
 from streamlink import Streamlink
+from streamlink.options import Options
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = Flask(__name__)
 
+# Log records are queued and written to stderr by a listener thread, so a burst of Twitch or ffmpeg
+# errors never blocks a request thread on console I/O. Messages use lazy %s formatting.
+log = logging.getLogger("kobo")
+log.setLevel(os.environ.get("LOG_LEVEL", "INFO").strip().upper())
+log.propagate = False
+log_queue = queue.SimpleQueue()
+log.addHandler(logging.handlers.QueueHandler(log_queue))
+log_stderr = logging.StreamHandler()
+log_stderr.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+log_listener = logging.handlers.QueueListener(log_queue, log_stderr)
+log_listener.start()
+
 # Environment Variables
 TWITCH_CLIENT_ID = os.environ.get("TWITCH_CLIENT_ID")
 TWITCH_SECRET = os.environ.get("TWITCH_SECRET")
@@ -23,24 +44,162 @@ FRAME_WIDTH = int(os.environ.get("FRAME_WIDTH", "1404"))
 FRAME_HEIGHT = int(os.environ.get("FRAME_HEIGHT", "1872"))
 # "cw" (clockwise), "ccw" (counter-clockwise), or "none"
 FRAME_ROTATE = os.environ.get("FRAME_ROTATE", "cw").strip().lower()
+# Where FRAME_ROTATE is applied: "ffmpeg" (transpose every frame) or "css" (send landscape frames and let
+# the viewer page rotate the <img>; saves a full-frame pass but needs CSS transforms in the browser)
+FRAME_ROTATE_MODE = os.environ.get("FRAME_ROTATE_MODE", "ffmpeg").strip().lower()
+# swscale algorithm for resizing; "area" is cheap and crisp when downscaling 1080p sources
+FRAME_SCALE_FLAGS = os.environ.get("FRAME_SCALE_FLAGS", "area").strip()
+# CPU resizer: "scale" (swscale) or "zscale" (libzimg, used only if this ffmpeg build has it).
+# With zscale, FRAME_SCALE_FLAGS names its kernel (point/bilinear/bicubic/spline16/spline36/lanczos).
+FRAME_SCALER = os.environ.get("FRAME_SCALER", "scale").strip().lower()
 # Target frames per second for the generated JPEGs. Lower default for e-ink comfort/CPU.
 FRAME_FPS = float(os.environ.get("FRAME_FPS", "1.5"))
+# How the viewer receives frames: "mjpeg" (one multipart push stream) or "poll" (JS re-fetches /frame.jpg)
+FRAME_MODE = os.environ.get("FRAME_MODE", "mjpeg").strip().lower()
 # Client refresh interval in ms (Kobo lacks native video; we "page-flip" JPEGs). Slower by default for e-ink.
 FRAME_REFRESH_MS = int(os.environ.get("FRAME_REFRESH_MS", "1500"))
 # JPEG quality for ffmpeg's mjpeg encoder: lower is better (2 ~= very high quality)
 FRAME_JPEG_QSCALE = int(os.environ.get("FRAME_JPEG_QSCALE", "2"))
+# Contrast boost around mid-gray for e-ink legibility (1.0 disables)
+FRAME_CONTRAST = float(os.environ.get("FRAME_CONTRAST", "1.15"))
+# Quantize frames to this many gray levels (e.g. 16 for most e-ink panels); 0 keeps all 256.
+# Fewer levels make PNG frames much smaller at no visible cost on the panel.
+FRAME_GRAY_LEVELS = int(os.environ.get("FRAME_GRAY_LEVELS", "0"))
+# zlib level for FRAME_CODEC=png (0-9): low levels encode fast, and quantized gray compresses well anyway
+FRAME_PNG_COMPRESSION = os.environ.get("FRAME_PNG_COMPRESSION", "1")
+# Frame encoding: "mjpeg" (default), "png" (lossless 8-bit gray; often smaller for text-heavy e-ink frames)
+# or "bmp" (uncompressed gray, no encode cost; only sensible on a fast LAN)
+FRAME_CODEC = os.environ.get("FRAME_CODEC", "mjpeg").strip().lower()
+# How often the category's stream listing is refreshed from Twitch in the background (seconds)
+TWITCH_STREAMS_TTL = float(os.environ.get("TWITCH_STREAMS_TTL", "30"))
+# How much input ffmpeg inspects before decoding. Twitch HLS is always H.264 so a short probe
+# is enough; raise these if ffmpeg fails to detect the stream on a very slow connection.
+FFMPEG_PROBESIZE = os.environ.get("FFMPEG_PROBESIZE", "1000000")
+FFMPEG_ANALYZEDURATION = os.environ.get("FFMPEG_ANALYZEDURATION", "1000000")
+# Who downloads the HLS segments: "url" (ffmpeg opens the playlist itself) or "streamlink" (Streamlink
+# fetches them with Twitch low-latency prefetch and ad-segment filtering and pipes MPEG-TS into ffmpeg)
+STREAM_INPUT = os.environ.get("STREAM_INPUT", "url").strip().lower()
+# Hardware decoder for the H.264 input ("auto" lets ffmpeg pick VAAPI/NVDEC/VideoToolbox if present; "none" disables).
+# "cuda" and "vaapi" also move scaling onto the GPU when ffmpeg has scale_cuda / scale_vaapi, so only the
+# small frame is downloaded.
+FFMPEG_HWACCEL = os.environ.get("FFMPEG_HWACCEL", "auto").strip().lower()
+# DRM render node used with FFMPEG_HWACCEL=vaapi
+FFMPEG_VAAPI_DEVICE = os.environ.get("FFMPEG_VAAPI_DEVICE", "/dev/dri/renderD128")
+# Scheduling priority for ffmpeg (0-19, higher = nicer) so request handling keeps a responsive CPU
+FFMPEG_NICE = int(os.environ.get("FFMPEG_NICE", "10"))
+# Optional CPU pinning for ffmpeg: comma-separated core ids, or "last" for the last available core
+FFMPEG_CPUS = os.environ.get("FFMPEG_CPUS", "").strip().lower()
+# ffmpeg is restarted when no new frame has been published for this long (seconds)
+FRAME_STALE_SECONDS = float(os.environ.get("FRAME_STALE_SECONDS", "10"))
+# How long a streamer's resolved HLS variants are reused before asking Twitch again (seconds)
+STREAMLINK_CACHE_TTL = float(os.environ.get("STREAMLINK_CACHE_TTL", "60"))
 PORT = int(os.environ.get("PORT", 5000))
 
 # Global State
-current_process = None
-current_streamer = None
-current_quality = None
-current_qscale = None
-current_fps = None
+# The selected stream and the ffmpeg decoding it, swapped as one immutable snapshot so readers never
+# see a half-updated selection. quality/qscale/fps are what was requested; process is None until
+# ffmpeg is running. source is Streamlink's open stream when it feeds ffmpeg's stdin (STREAM_INPUT=streamlink).
+StreamState = namedtuple("StreamState", "streamer quality qscale fps process source")
+current_state = None
 last_restart_time = 0
+# Minimum gap between restarts of the same stream; doubles (with jitter) on every retry until a frame arrives
+RESTART_BACKOFF_MIN = 5.0
+RESTART_BACKOFF_MAX = 300.0
+restart_backoff = RESTART_BACKOFF_MIN
 stream_lock = threading.Lock()
-FRAME_PATH = "current.jpg"
+# Bumped by every stop; a start whose generation is no longer current must not launch ffmpeg
+start_generation = 0
 PLACEHOLDER_PATH = "placeholder.jpg"
+# Placeholder image bytes, loaded or rendered once at startup (load_placeholder) and then kept in memory
+placeholder_frame = None
+# Served until placeholder_frame is ready: a 1x1 transparent GIF, shown as white on the page background
+BLANK_GIF = (
+    b"GIF89a\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff\x00\x00\x00!\xf9\x04\x01\x00\x00\x00\x00"
+    b",\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+)
+# FRAME_ROTATE in degrees clockwise (0 = no rotation)
+ROTATE_DEGREES = {
+    "cw": 90, "clockwise": 90, "90": 90,
+    "ccw": -90, "counterclockwise": -90, "counter-clockwise": -90, "-90": -90, "270": -90,
+}.get(FRAME_ROTATE, 0)
+# Rotation the viewer page applies with a CSS transform instead of ffmpeg (0 = none)
+CSS_ROTATE_DEGREES = ROTATE_DEGREES if FRAME_ROTATE_MODE == "css" else 0
+# Resampling kernels zscale understands, for FRAME_SCALE_FLAGS when FRAME_SCALER=zscale
+ZSCALE_KERNELS = ("point", "bilinear", "bicubic", "spline16", "spline36", "lanczos")
+# ffmpeg's (hwaccel names, filter names), probed on first use
+ffmpeg_caps = None
+# -vf chains already built: {(fps, scaler): filter string}
+video_filters = {}
+
+# Latest frame published by the ffmpeg reader thread: (image bytes, monotonic timestamp, version).
+# Replaced as a whole tuple, so readers take it without locking and always see a consistent triple.
+latest_frame = (b"", 0.0, 0)
+# Notified on every publish so MJPEG streams wake exactly when a new frame lands
+frame_cond = threading.Condition()
+# Set when the current ffmpeg's output ends or a new selection is queued, so the supervisor reacts now
+# rather than on its next tick
+supervisor_wake = threading.Event()
+# Selections from view() as (streamer, quality, qscale, fps); only the supervisor starts or restarts ffmpeg
+start_requests = queue.SimpleQueue()
+
+# Encodings ffmpeg can emit on stdout: (output args, mimetype, start marker, end marker).
+# BMP has no end marker; its total size is stored right after the "BM" signature.
+FRAME_CODECS = {
+    # Standard Huffman tables: skips the encoder's second, table-optimizing pass over every frame
+    "mjpeg": (["-huffman", "default", "-f", "mjpeg"], "image/jpeg", b"\xff\xd8", b"\xff\xd9"),
+    "png": (
+        [
+            "-c:v", "png", "-pix_fmt", "gray",
+            "-compression_level", FRAME_PNG_COMPRESSION, "-pred", "mixed",
+            "-f", "image2pipe",
+        ],
+        "image/png",
+        b"\x89PNG\r\n\x1a\n",
+        b"IEND\xaeB`\x82",
+    ),
+    "bmp": (["-c:v", "bmp", "-pix_fmt", "gray", "-f", "image2pipe"], "image/bmp", b"BM", None),
+}
+FRAME_OUTPUT_ARGS, FRAME_MIMETYPE, FRAME_START, FRAME_END = FRAME_CODECS.get(FRAME_CODEC, FRAME_CODECS["mjpeg"])
+# The parts of the ffmpeg command that never change between starts; only the hwaccel, URL, filter
+# chain and quality are filled in per stream.
+FFMPEG_GLOBAL_ARGS = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"]
+FFMPEG_INPUT_ARGS = [
+    "-reconnect", "1",           # Reconnect on network failure
+    "-reconnect_streamed", "1",  # Reconnect even for streamed data
+    "-reconnect_delay_max", "5", # Max delay for reconnect
+    "-fflags", "nobuffer",       # Don't buffer input before decoding
+    "-flags", "low_delay",
+    "-analyzeduration", FFMPEG_ANALYZEDURATION,
+    "-probesize", FFMPEG_PROBESIZE,
+    "-live_start_index", "-2",   # Join two segments from the live edge (HLS default is three)
+]
+# For STREAM_INPUT=streamlink: Twitch segments are MPEG-TS, and the HTTP/HLS options above would be
+# rejected by ffmpeg's pipe input
+FFMPEG_PIPE_INPUT_ARGS = [
+    "-fflags", "nobuffer",
+    "-flags", "low_delay",
+    "-analyzeduration", FFMPEG_ANALYZEDURATION,
+    "-probesize", FFMPEG_PROBESIZE,
+    "-f", "mpegts",
+]
+FFMPEG_OUTPUT_ARGS = [
+    "-an", "-sn", "-dn",         # Video only; skip audio/subtitle/data streams
+    "-threads", "1",             # One encoder thread is plenty for a few small frames a second
+    "-map_metadata", "-1",
+    "-vsync", "0",
+    "-flush_packets", "1",
+    *FRAME_OUTPUT_ARGS,
+    "pipe:1",
+]
+# Per-part multipart header for /stream.mjpg; only the length changes between frames.
+# Caching headers are sent once on the stream response, not repeated per part.
+# Plausible bfSize range for FRAME_CODEC=bmp: at least the 14-byte file header, at most a 4K gray frame
+# with palette and row padding. Anything else means the reader lost sync with ffmpeg's output.
+BMP_MIN_BYTES = 14
+BMP_MAX_BYTES = 4096 * 4096 + 4096
+# Longest a /stream.mjpg client goes without a part; idle streams repeat a frame so dead sockets are noticed
+MJPEG_KEEPALIVE_SECONDS = 10
+MJPEG_PART_HEADER = b"--frame\r\nContent-Type: " + FRAME_MIMETYPE.encode("ascii") + b"\r\nContent-Length: %d\r\n\r\n"
 
 # Twitch API Helper
 class TwitchAPI:
@@ -49,306 +208,807 @@ class TwitchAPI:
         self.client_secret = client_secret
         self.token = None
         self.token_expiry = 0
+        # Serializes renewals so the poller, ?refresh=1 and 401 retries don't each fetch a token
+        self.token_lock = threading.Lock()
+        # One keep-alive session so repeat calls skip the TCP/TLS handshake
+        self.session = requests.Session()
+        self.session.headers.update({"Client-ID": client_id or ""})
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        # Game IDs never change, so they are cached for the life of the process
+        self._game_ids = {}
 
-    def get_token(self):
-        if self.token and time.time() < self.token_expiry:
+    def get_token(self, rejected=None):
+        """
+        Return a valid app token, renewing it when it nears expiry or when Helix rejected `rejected`.
+        """
+        if self.token and self.token != rejected and time.time() < self.token_expiry:
             return self.token
-        
-        url = "https://id.twitch.tv/oauth2/token"
-        params = {
-            "client_id": self.client_id,
-            "client_secret": self.client_secret,
-            "grant_type": "client_credentials"
-        }
-        try:
-            resp = requests.post(url, params=params).json()
-            if "access_token" in resp:
-                self.token = resp["access_token"]
-                self.token_expiry = time.time() + resp["expires_in"] - 60
+
+        with self.token_lock:
+            # Another thread may have renewed it while this one waited
+            if self.token and self.token != rejected and time.time() < self.token_expiry:
                 return self.token
-        except Exception as e:
-            print(f"Error getting token: {e}")
-        return None
+
+            url = "https://id.twitch.tv/oauth2/token"
+            params = {
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "grant_type": "client_credentials"
+            }
+            try:
+                # None drops the session's stale Bearer header from this request
+                resp = self.session.post(url, params=params, headers={"Authorization": None}, timeout=5).json()
+                if "access_token" in resp:
+                    self.token = resp["access_token"]
+                    self.token_expiry = time.time() + resp["expires_in"] - 60
+                    self.session.headers["Authorization"] = f"Bearer {self.token}"
+                    return self.token
+            except Exception as e:
+                log.warning("Token request failed: %s", e)
+            return None
+
+    def helix_get(self, url, params):
+        """
+        GET a Helix endpoint. A 401 (token revoked or expired early) renews the token and retries once.
+        """
+        token = self.token
+        resp = self.session.get(url, params=params, timeout=5)
+        if resp.status_code == 401 and self.get_token(rejected=token):
+            resp = self.session.get(url, params=params, timeout=5)
+        return resp
 
     def get_game_id(self, game_name):
+        if game_name in self._game_ids:
+            return self._game_ids[game_name]
+
         token = self.get_token()
         if not token: return None
         
-        headers = {
-            "Client-ID": self.client_id,
-            "Authorization": f"Bearer {token}"
-        }
         url = "https://api.twitch.tv/helix/games"
         params = {"name": game_name}
         
         try:
-            resp = requests.get(url, headers=headers, params=params).json()
+            resp = self.helix_get(url, params).json()
             if resp.get("data"):
-                return resp["data"][0]["id"]
+                game_id = resp["data"][0]["id"]
+                self._game_ids[game_name] = game_id
+                return game_id
         except Exception as e:
-            print(f"Error getting game ID: {e}")
+            log.warning("Game ID request failed: %s", e)
         return None
 
     def get_streams(self, game_name):
+        """Return live streams for the category, or None if Twitch couldn't be reached."""
+        # Renews the app token once it nears expiry; a no-op while it is still valid
+        if not self.get_token():
+            return None
         game_id = self.get_game_id(game_name)
         if not game_id:
-            return []
+            return None
             
-        token = self.get_token()
-        headers = {
-            "Client-ID": self.client_id,
-            "Authorization": f"Bearer {token}"
-        }
         url = "https://api.twitch.tv/helix/streams"
         params = {"game_id": game_id, "first": 20}
         
         try:
-            resp = requests.get(url, headers=headers, params=params).json()
-            return resp.get("data", [])
+            resp = self.helix_get(url, params)
+            data = resp.json().get("data") if resp.ok else None
+            # Error bodies (401/429/5xx) have no "data"; report failure so the last good listing is kept
+            return data if isinstance(data, list) else None
         except Exception as e:
-            print(f"Error getting streams: {e}")
-            return []
+            log.warning("Streams request failed: %s", e)
+            return None
+
+class StreamsCache:
+    """
+    Polls Twitch for the category's streams in the background so `/` never waits on the API.
+    The last good listing is kept when Twitch is unreachable.
+    """
+    def __init__(self, api, category, interval):
+        self.api = api
+        self.category = category
+        self.interval = interval
+        self.streams = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        # Poll passes started / finished, so a caller can wait for one that began after its request
+        self.started = 0
+        self.finished = 0
+        self.done = threading.Condition(self.lock)
+
+    def get(self):
+        with self.lock:
+            return self.streams
+
+    def refresh(self):
+        streams = self.api.get_streams(self.category)
+        if streams is not None:
+            with self.lock:
+                self.streams = streams
+
+    def run(self):
+        while True:
+            # Cleared before the fetch, so a request arriving mid-refresh gets a pass of its own
+            self.wake.clear()
+            with self.lock:
+                self.started += 1
+                current = self.started
+            try:
+                self.refresh()
+            except Exception as e:
+                log.warning("Error refreshing streams: %s", e)
+            with self.done:
+                self.finished = current
+                self.done.notify_all()
+            self.wake.wait(self.interval)
+
+    def request_refresh(self):
+        """Ask the poller to refresh now instead of at its next interval; never blocks the caller."""
+        self.wake.set()
+
+    def wait_for_refresh(self, timeout):
+        """
+        Ask the poller for a fresh listing and wait up to timeout seconds for it; the caller then
+        reads whatever listing is current, fresh or not.
+        """
+        with self.done:
+            target = self.started + 1
+            self.request_refresh()
+            self.done.wait_for(lambda: self.finished >= target, timeout=timeout)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
 
 twitch_api = TwitchAPI(TWITCH_CLIENT_ID, TWITCH_SECRET)
+streams_cache = StreamsCache(twitch_api, TWITCH_CATEGORY, TWITCH_STREAMS_TTL)
 
 def create_streamlink_session():
     """
     Configure Streamlink with settings optimized for stability on slow connections.
     """
     session = Streamlink()
-    session.set_option("hls-live-edge", 3)              # Increase buffer slightly
+    session.set_option("hls-live-edge", 2)              # Stay close to live; low-latency prefetch covers gaps
     session.set_option("hls-segment-threads", 2)        # Allow parallel segment downloads
     session.set_option("stream-segment-threads", 2)
     session.set_option("hls-segment-queue-size", 4)     # Increase queue size
     session.set_option("hls-playlist-reload-attempts", 3)
     session.set_option("hls-segment-attempts", 3)
+    # Hard memory bounds for when Streamlink itself reads segments (default ring buffer is 16 MB)
+    session.set_option("ringbuffer-size", 1024 * 1024)
+    session.set_option("stream-segment-timeout", 5.0)
+    session.set_option("stream-timeout", 10.0)
+    # Playlist lookups run on the supervisor thread; don't let a slow Twitch edge hold it for long
+    session.set_option("http-timeout", 10.0)
     return session
 
-def get_stream_qualities(streamer_name):
+# One Streamlink session for the whole process; its plugins and HTTP pool are reused across lookups.
+streamlink_session = create_streamlink_session()
+# Twitch plugin options for every lookup: prefetch segments so playback sits near the live edge
+TWITCH_PLUGIN_OPTIONS = Options({"low-latency": True})
+# Resolved variants per streamer: {streamer: (monotonic expiry, {quality: stream})}
+resolved_streams = {}
+# Streamers with a background lookup in flight
+prefetching = set()
+prefetch_lock = threading.Lock()
+
+def resolve_streams(streamer_name, fresh=False):
     """
-    Return available qualities for the streamer.
+    Return Streamlink's {quality: stream} map for the streamer, reusing a recent lookup unless fresh.
     """
-    session = create_streamlink_session()
-    try:
-        streams = session.streams(f"twitch.tv/{streamer_name}")
-        return list(streams.keys()) if streams else []
-    except Exception as e:
-        print(f"Error listing qualities for {streamer_name}: {e}")
-        return []
-    finally:
+    cached = resolved_streams.get(streamer_name)
+    if cached and not fresh and time.monotonic() < cached[0]:
+        return cached[1]
+    streams = streamlink_session.streams(f"twitch.tv/{streamer_name}", options=TWITCH_PLUGIN_OPTIONS)
+    if streams:
+        resolved_streams[streamer_name] = (time.monotonic() + STREAMLINK_CACHE_TTL, streams)
+    else:
+        resolved_streams.pop(streamer_name, None)
+    return streams
+
+def prefetch_streams(streamer_name):
+    """
+    Resolve the streamer's variants on a background thread (one at a time per streamer).
+    """
+    with prefetch_lock:
+        if streamer_name in prefetching:
+            return
+        prefetching.add(streamer_name)
+
+    def run():
         try:
-            session.http.close()
-        except Exception:
-            pass
+            resolve_streams(streamer_name)
+        except Exception as e:
+            log.warning("Error listing qualities for %s: %s", streamer_name, e)
+        finally:
+            with prefetch_lock:
+                prefetching.discard(streamer_name)
+
+    threading.Thread(target=run, daemon=True).start()
+
+def get_stream_qualities(streamer_name):
+    """
+    Return the streamer's qualities from the cache. An expired entry is still served while a single
+    background lookup refreshes it; on a miss that lookup starts and [] is returned, so the page
+    renders with the baseline list instead of waiting on Twitch.
+    """
+    cached = resolved_streams.get(streamer_name)
+    if cached and time.monotonic() < cached[0]:
+        return list(cached[1])
+    prefetch_streams(streamer_name)
+    return list(cached[1]) if cached else []
+
+# Variants tried, in order, when the requested quality isn't offered
+STREAM_FALLBACK_ORDER = ("source", "1080p60", "1080p", "best", "720p60", "720p", "480p", "360p", "worst")
 
 def pick_stream(streams, desired_quality):
     """
     Pick the best available stream object preferring the user choice, then sane fallbacks.
     """
-    order = [
-        desired_quality,
-        "source",
-        "1080p60",
-        "1080p",
-        "best",
-        "720p60",
-        "720p",
-        "480p",
-        "360p",
-        "worst",
-    ]
-    for q in order:
-        if q and q in streams:
+    if desired_quality and desired_quality in streams:
+        return desired_quality, streams[desired_quality]
+    for q in STREAM_FALLBACK_ORDER:
+        if q in streams:
             return q, streams[q]
     # Final fallback: first available
-    if streams:
-        q = next(iter(streams.keys()))
+    for q in streams:
         return q, streams[q]
     return None, None
 
+def publish_frame(data):
+    global latest_frame
+    with frame_cond:
+        latest_frame = (data, time.monotonic(), latest_frame[2] + 1)
+        frame_cond.notify_all()
+
+def get_latest_frame():
+    """Return (image bytes, monotonic timestamp, version) of the newest frame."""
+    return latest_frame
+
+def wait_for_frame(last_version, timeout):
+    """
+    Block until a frame other than last_version is published (or timeout); return (bytes, version).
+    """
+    with frame_cond:
+        frame_cond.wait_for(lambda: latest_frame[2] != last_version, timeout=timeout)
+        data, _, version = latest_frame
+        return data, version
+
+def render_placeholder():
+    """
+    Have ffmpeg encode a blank panel-sized frame in the configured codec.
+    """
+    width = FRAME_WIDTH if FRAME_WIDTH > 0 else 1404
+    height = FRAME_HEIGHT if FRAME_HEIGHT > 0 else 1872
+    if CSS_ROTATE_DEGREES:
+        # Real frames arrive landscape and the page turns them; match that
+        width, height = height, width
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-f", "lavfi",
+        "-i", f"color=c=white:s={width}x{height}",
+        "-frames:v", "1",
+        "-vf", "format=gray",
+        *FRAME_OUTPUT_ARGS,
+        "pipe:1"
+    ]
+    try:
+        return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=10).stdout
+    except Exception as e:
+        log.warning("Error rendering placeholder: %s", e)
+        return b""
+
+def load_placeholder():
+    """
+    Prepare the image served before the first real frame arrives. PLACEHOLDER_PATH wins if present
+    (JPEG only); otherwise ffmpeg renders one. Runs once at startup on a background thread.
+    """
+    global placeholder_frame
+    data = b""
+    if FRAME_MIMETYPE == "image/jpeg":
+        try:
+            with open(PLACEHOLDER_PATH, "rb") as f:
+                data = f.read()
+        except OSError:
+            pass
+    placeholder_frame = data or render_placeholder()
+
+def get_placeholder():
+    """
+    Return (bytes, mimetype) for the placeholder; BLANK_GIF until load_placeholder has produced it.
+    """
+    if placeholder_frame:
+        return placeholder_frame, FRAME_MIMETYPE
+    return BLANK_GIF, "image/gif"
+
+def read_frames(proc):
+    """
+    Split ffmpeg's stdout into complete images (start..end marker) and publish the newest one.
+    Marker searches use bytearray.find (memchr/memmem in C) and never rescan bytes already checked.
+    """
+    global restart_backoff
+    buf = bytearray()
+    chunk = bytearray(65536)
+    chunk_view = memoryview(chunk)
+    scan_from = 0  # Offset in buf where the end-marker search resumes
+    got_frame = False
+    try:
+        while True:
+            n = proc.stdout.readinto(chunk)
+            if not n:
+                break
+            buf += chunk_view[:n]
+            while True:
+                start = buf.find(FRAME_START)
+                if start < 0:
+                    # Keep a tail in case the start marker is split across reads
+                    del buf[:-(len(FRAME_START) - 1)]
+                    scan_from = 0
+                    break
+                if FRAME_END is None:
+                    # Length-prefixed (BMP): wait until the whole declared size has arrived
+                    end = -1
+                    if len(buf) >= start + 6:
+                        size = int.from_bytes(buf[start + 2:start + 6], "little")
+                        if not BMP_MIN_BYTES <= size <= BMP_MAX_BYTES:
+                            # Not a real header (e.g. "BM" inside pixel data): resync past it
+                            del buf[:start + len(FRAME_START)]
+                            scan_from = 0
+                            continue
+                        end = start + size
+                        if end > len(buf):
+                            end = -1
+                    if end < 0:
+                        del buf[:start]
+                        break
+                else:
+                    end = buf.find(FRAME_END, max(scan_from, start + len(FRAME_START)))
+                    if end < 0:
+                        del buf[:start]
+                        # Resume just before the tail next time in case the end marker is split across reads
+                        scan_from = max(0, len(buf) - len(FRAME_END) + 1)
+                        break
+                    end += len(FRAME_END)
+                # A process that is being replaced must not overwrite the new stream's frames
+                state = current_state
+                if state and proc is state.process:
+                    publish_frame(bytes(buf[start:end]))
+                    if not got_frame:
+                        # The stream is healthy again; the next failure starts from the short delay
+                        got_frame = True
+                        restart_backoff = RESTART_BACKOFF_MIN
+                del buf[:end]
+                scan_from = 0
+    except Exception as e:
+        log.warning("Frame reader error: %s", e)
+    finally:
+        chunk_view.release()
+        try:
+            proc.stdout.close()
+        except Exception:
+            pass
+        state = current_state
+        if state and proc is state.process:
+            # EOF usually means ffmpeg is exiting; let it finish so the supervisor sees it as dead
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
+            supervisor_wake.set()
+
+def feed_stream(source, proc):
+    """
+    Copy Streamlink's segment data into ffmpeg's stdin until either side ends (STREAM_INPUT=streamlink).
+    """
+    try:
+        while True:
+            data = source.read(65536)
+            if not data:
+                break
+            proc.stdin.write(data)
+    except (BrokenPipeError, OSError, ValueError):
+        pass # ffmpeg exited or the stream was stopped
+    except Exception as e:
+        log.warning("Stream feed error: %s", e)
+    finally:
+        source.close()
+        try:
+            proc.stdin.close()
+        except Exception:
+            pass
+
+def close_source(source):
+    """
+    Close a Streamlink stream off the caller's thread; close() joins its segment threads.
+    """
+    threading.Thread(target=source.close, daemon=True).start()
+
+def deprioritize_process(pid):
+    """
+    Renice ffmpeg and optionally pin it to dedicated cores (Linux only; best effort elsewhere).
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, pid, FFMPEG_NICE)
+    except (AttributeError, OSError) as e:
+        log.warning("Could not renice ffmpeg: %s", e)
+
+    if not FFMPEG_CPUS:
+        return
+    try:
+        if FFMPEG_CPUS == "last":
+            cpus = {max(os.sched_getaffinity(0))}
+        else:
+            cpus = {int(c) for c in FFMPEG_CPUS.split(",") if c.strip()}
+        os.sched_setaffinity(pid, cpus)
+    except (AttributeError, OSError, ValueError) as e:
+        log.warning("Could not pin ffmpeg to CPUs %s: %s", FFMPEG_CPUS, e)
+
+def probe_ffmpeg():
+    """
+    Return the hwaccels and filters this ffmpeg build supports, asking it only once.
+    """
+    global ffmpeg_caps
+    if ffmpeg_caps is None:
+        hwaccels, filters = set(), set()
+        try:
+            out = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-hwaccels"], capture_output=True, text=True, timeout=10
+            ).stdout
+            # First line is the "Hardware acceleration methods:" heading
+            hwaccels = {line.strip() for line in out.splitlines()[1:] if line.strip()}
+            out = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-filters"], capture_output=True, text=True, timeout=10
+            ).stdout
+            # Filter rows look like " ... scale_cuda  V->V  GPU accelerated video resizer"
+            filters = {fields[1] for fields in map(str.split, out.splitlines()) if len(fields) > 2}
+        except Exception as e:
+            log.warning("Could not probe ffmpeg capabilities: %s", e)
+        ffmpeg_caps = (hwaccels, filters)
+    return ffmpeg_caps
+
+def hwaccel_settings():
+    """
+    Return (ffmpeg input args, GPU scale filter or None) for FFMPEG_HWACCEL.
+    """
+    if not FFMPEG_HWACCEL or FFMPEG_HWACCEL == "none":
+        return [], None
+    if FFMPEG_HWACCEL == "auto":
+        # ffmpeg picks a method itself and silently falls back to software decoding
+        return ["-hwaccel", "auto"], None
+    hwaccels, filters = probe_ffmpeg()
+    if FFMPEG_HWACCEL not in hwaccels:
+        log.warning("ffmpeg has no %s hwaccel; decoding on the CPU", FFMPEG_HWACCEL)
+        return [], None
+    # Keep decoded frames in GPU memory until the GPU scaler has shrunk them
+    if FFMPEG_HWACCEL == "cuda" and "scale_cuda" in filters:
+        return ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"], "scale_cuda"
+    if FFMPEG_HWACCEL == "vaapi" and "scale_vaapi" in filters:
+        return [
+            "-hwaccel", "vaapi",
+            "-hwaccel_output_format", "vaapi",
+            "-vaapi_device", FFMPEG_VAAPI_DEVICE,
+        ], "scale_vaapi"
+    return ["-hwaccel", FFMPEG_HWACCEL], None
+
+def cpu_scaler():
+    """
+    Return the software scale filter to use: zscale when requested and available, else scale.
+    """
+    if FRAME_SCALER == "zscale":
+        if "zscale" in probe_ffmpeg()[1]:
+            return "zscale"
+        log.warning("ffmpeg has no zscale filter; resizing with scale")
+    return "scale"
+
+def enlarge_pipe(fd, size=1024 * 1024):
+    """
+    Grow the ffmpeg stdout pipe so a whole frame fits without ffmpeg blocking mid-write (Linux only).
+    1 MB is the default /proc/sys/fs/pipe-max-size for unprivileged processes.
+    """
+    try:
+        import fcntl
+        fcntl.fcntl(fd, getattr(fcntl, "F_SETPIPE_SZ", 1031), size)
+    except (ImportError, OSError) as e:
+        log.warning("Could not enlarge ffmpeg pipe: %s", e)
+
+def build_video_filter(fps, scaler):
+    """
+    Return the ffmpeg -vf chain for the panel at this fps and scale filter; the other settings are
+    fixed per process, so each chain is built once.
+    """
+    key = (fps, scaler)
+    if key in video_filters:
+        return video_filters[key]
+
+    # Construct ffmpeg filters. Drop to a single luma plane right after decimation so
+    # transpose, scale and pad each touch one plane instead of three. With GPU scaling the
+    # frame is resized in GPU memory first and only the downscaled image is downloaded.
+    on_gpu = scaler in ("scale_cuda", "scale_vaapi")
+    vf_parts = [f"fps={fps}"]
+    if not on_gpu:
+        vf_parts.append("format=gray")
+    scale_flags = f":flags={FRAME_SCALE_FLAGS}" if scaler == "scale" else ""
+    zscale_kernel = FRAME_SCALE_FLAGS if FRAME_SCALE_FLAGS in ZSCALE_KERNELS else "bilinear"
+
+    # Rotation; with FRAME_ROTATE_MODE=css the page turns the image and ffmpeg leaves it landscape
+    rotated = ROTATE_DEGREES != 0
+    rotate_filter = None
+    if not CSS_ROTATE_DEGREES:
+        if ROTATE_DEGREES == 90:
+            rotate_filter = "transpose=1"
+        elif ROTATE_DEGREES == -90:
+            rotate_filter = "transpose=2"
+
+    # Scale before rotating so transpose only moves the downscaled frame. The frame is still
+    # landscape at this point, so the target box is swapped when a rotation follows.
+    if FRAME_WIDTH > 0 and FRAME_HEIGHT > 0:
+        box_w, box_h = (FRAME_HEIGHT, FRAME_WIDTH) if rotated else (FRAME_WIDTH, FRAME_HEIGHT)
+        if scaler == "zscale":
+            # zscale has no force_original_aspect_ratio, so the box is fitted with size expressions
+            vf_parts.append(
+                f"zscale=w='min({box_w},iw*{box_h}/ih)':h='min({box_h},ih*{box_w}/iw)':f={zscale_kernel}"
+            )
+        else:
+            vf_parts.append(
+                f"{scaler}={box_w}:{box_h}:force_original_aspect_ratio=decrease{scale_flags}"
+            )
+    elif FRAME_WIDTH > 0:
+        if scaler == "zscale":
+            if rotated:
+                vf_parts.append(f"zscale=w=trunc(iw*{FRAME_WIDTH}/ih/2)*2:h={FRAME_WIDTH}:f={zscale_kernel}")
+            else:
+                vf_parts.append(f"zscale=w={FRAME_WIDTH}:h=trunc(ih*{FRAME_WIDTH}/iw/2)*2:f={zscale_kernel}")
+        elif rotated:
+            vf_parts.append(f"{scaler}=-2:{FRAME_WIDTH}{scale_flags}")
+        else:
+            vf_parts.append(f"{scaler}={FRAME_WIDTH}:-2{scale_flags}")
+
+    if on_gpu:
+        vf_parts.extend(["hwdownload", "format=nv12", "format=gray"])
+
+    # Enhance for E-ink, before padding so only picture pixels are filtered
+    # Contrast and gray-level quantization share one lut: on the gray plane it is a 256-entry table
+    # built once, not float math per pixel. lut clips its final output to 0-255 itself.
+    level = "val"
+    if FRAME_CONTRAST != 1.0:
+        level = f"(val-128)*{FRAME_CONTRAST:g}+128"
+    if FRAME_GRAY_LEVELS > 1:
+        steps = FRAME_GRAY_LEVELS - 1
+        level = f"round(clip({level},0,255)*{steps}/255)*255/{steps}"
+    if level != "val":
+        vf_parts.append(f"lut=c0='{level}'")
+    vf_parts.append("unsharp=3:3:1.0") # Sharpen edges; a 3x3 kernel is enough at panel resolution
+
+    if rotate_filter:
+        vf_parts.append(rotate_filter)
+
+    if FRAME_WIDTH > 0 and FRAME_HEIGHT > 0:
+        pad_w, pad_h = (FRAME_HEIGHT, FRAME_WIDTH) if CSS_ROTATE_DEGREES else (FRAME_WIDTH, FRAME_HEIGHT)
+        vf_parts.append(
+            f"pad={pad_w}:{pad_h}:(ow-iw)/2:(oh-ih)/2:color=white"
+        )
+    vf_parts.append("setsar=1")
+
+    vf = ",".join(vf_parts)
+    video_filters[key] = vf
+    return vf
+
 def start_stream_processing(streamer_name, preferred_quality=None, image_qscale=None, frame_fps=None):
-    global current_process, current_streamer, current_quality, current_qscale, current_fps, last_restart_time
+    global current_state, last_restart_time, restart_backoff
     
     with stream_lock:
-        desired_quality = preferred_quality or TWITCH_STREAM_QUALITY
-        desired_qscale = image_qscale or FRAME_JPEG_QSCALE
-        desired_fps = frame_fps or FRAME_FPS
-
-        if (
-            current_streamer == streamer_name
-            and current_quality == desired_quality
-            and current_qscale == desired_qscale
-            and current_fps == desired_fps
-            and current_process
-            and current_process.poll() is None
-        ):
+        desired = StreamState(
+            streamer_name,
+            preferred_quality or TWITCH_STREAM_QUALITY,
+            image_qscale or FRAME_JPEG_QSCALE,
+            frame_fps or FRAME_FPS,
+            None,
+            None,
+        )
+
+        is_retry = current_state is not None and current_state[:4] == desired[:4]
+        if is_retry and current_state.process and current_state.process.poll() is None:
             return # Already watching this streamer at requested quality
-        
+
         # Rate limit restarts
-        if (
-            time.time() - last_restart_time < 5
-            and current_streamer == streamer_name
-            and current_quality == desired_quality
-            and current_qscale == desired_qscale
-            and current_fps == desired_fps
-        ):
+        if is_retry and time.monotonic() - last_restart_time < restart_backoff:
             return
 
+        # Back off exponentially while the same stream keeps failing; a new selection starts fresh
+        if is_retry:
+            restart_backoff = min(restart_backoff * 2, RESTART_BACKOFF_MAX) + random.uniform(0, 1)
+        else:
+            restart_backoff = RESTART_BACKOFF_MIN
+
         # Stop existing process
         stop_stream_processing()
             
-        current_streamer = streamer_name
-        current_quality = desired_quality
-        current_qscale = desired_qscale
-        current_fps = desired_fps
-        last_restart_time = time.time()
+        current_state = desired
+        last_restart_time = time.monotonic()
+        generation = start_generation
+
+    # The Streamlink lookup is network-bound, so it runs without the lock; view() and the supervisor
+    # stay responsive meanwhile. Any stop or newer start bumps start_generation and retires this one.
+    try:
+        # Get Stream URL using Streamlink. Retries skip the cache in case the HLS URL expired.
+        streams = resolve_streams(streamer_name, fresh=is_retry)
+        if not streams:
+            log.info("No streams found for %s", streamer_name)
+            return
+        
+        quality_used, stream_obj = pick_stream(streams, desired.quality)
+        if not stream_obj:
+            log.info("No usable stream qualities found for %s: %s", streamer_name, list(streams))
+            return
+        
+        if STREAM_INPUT == "streamlink":
+            input_args = [*FFMPEG_PIPE_INPUT_ARGS, "-i", "pipe:0"]
+        else:
+            input_args = [*FFMPEG_INPUT_ARGS, "-i", stream_obj.url]
+        hwaccel_args, gpu_scaler = hwaccel_settings()
+        vf = build_video_filter(desired.fps, gpu_scaler or cpu_scaler())
         
-        # Get Stream URL using Streamlink
-        session = create_streamlink_session()
+        cmd = [
+            *FFMPEG_GLOBAL_ARGS,
+            *hwaccel_args,
+            *input_args,
+            "-vf", vf,
+            "-q:v", str(desired.qscale),
+            *FFMPEG_OUTPUT_ARGS,
+        ]
+        # Opened last: from here on Streamlink is downloading segments in the background
+        source = stream_obj.open() if STREAM_INPUT == "streamlink" else None
+    except Exception as e:
+        log.error("Error starting stream: %s", e)
+        return
+
+    with stream_lock:
+        if generation != start_generation:
+            if source:
+                close_source(source)
+            return # Superseded by a newer selection or a stop while resolving
         try:
-            streams = session.streams(f"twitch.tv/{streamer_name}")
-            if not streams:
-                print(f"No streams found for {streamer_name}")
-                return
-            
-            quality_used, stream_obj = pick_stream(streams, desired_quality)
-            if not stream_obj:
-                print(f"No usable stream qualities found for {streamer_name}: {list(streams.keys())}")
-                return
-            stream_url = stream_obj.url
-            current_quality = quality_used
-            
-            # Construct ffmpeg filters
-            vf_parts = [f"fps={desired_fps}"]
-            
-            # Rotation
-            if FRAME_ROTATE in ("cw", "clockwise", "90"):
-                vf_parts.append("transpose=1")
-            elif FRAME_ROTATE in ("ccw", "counterclockwise", "counter-clockwise", "-90", "270"):
-                vf_parts.append("transpose=2")
-
-            # Scaling
-            if FRAME_WIDTH > 0 and FRAME_HEIGHT > 0:
-                vf_parts.append(
-                    f"scale={FRAME_WIDTH}:{FRAME_HEIGHT}:force_original_aspect_ratio=decrease:flags=lanczos"
-                )
-                vf_parts.append(
-                    f"pad={FRAME_WIDTH}:{FRAME_HEIGHT}:(ow-iw)/2:(oh-ih)/2:color=white"
-                )
-            elif FRAME_WIDTH > 0:
-                vf_parts.append(f"scale={FRAME_WIDTH}:-2:flags=lanczos")
-
-            # Format and Enhance for E-ink
-            vf_parts.append("format=gray")
-            vf_parts.append("eq=contrast=1.15:saturation=1.0") # Boost contrast slightly for visibility
-            vf_parts.append("unsharp=5:5:1.0:5:5:0.0") # Sharpen to make details clearer
-            vf_parts.append("setsar=1")
-            
-            vf = ",".join(vf_parts)
-            
-            cmd = [
-                "ffmpeg",
-                "-hide_banner",
-                "-loglevel", "error",
-                "-y",
-                "-reconnect", "1",           # Reconnect on network failure
-                "-reconnect_streamed", "1",  # Reconnect even for streamed data
-                "-reconnect_delay_max", "5", # Max delay for reconnect
-                "-analyzeduration", "10000000",
-                "-probesize", "10000000",
-                "-i", stream_url,
-                "-vf", vf,
-                "-q:v", str(desired_qscale),
-                "-map_metadata", "-1",
-                "-vsync", "0",
-                "-flush_packets", "1",
-                "-update", "1",
-                FRAME_PATH
-            ]
-            
-            # Run in background
-            current_process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            print(f"Started ffmpeg for {streamer_name} at {current_quality}")
-            
+            # Run in background; frames are read from stdout instead of a file on disk
+            # Own session/process group: a terminal Ctrl-C doesn't hit ffmpeg mid-write, and
+            # stop_stream_processing can signal the whole group.
+            process = subprocess.Popen(
+                cmd, stdin=subprocess.PIPE if source else None, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, bufsize=0, start_new_session=True
+            )
+            current_state = desired._replace(process=process, source=source)
+            deprioritize_process(process.pid)
+            enlarge_pipe(process.stdout.fileno())
+            threading.Thread(target=read_frames, args=(process,), daemon=True).start()
+            if source:
+                threading.Thread(target=feed_stream, args=(source, process), daemon=True).start()
+            log.info("Started ffmpeg for %s at %s", streamer_name, quality_used)
         except Exception as e:
-            print(f"Error starting stream: {e}")
-        finally:
-            try:
-                session.http.close()
-            except Exception:
-                pass
+            if source:
+                close_source(source)
+            log.error("Error starting stream: %s", e)
+
+def signal_process_group(process, sig):
+    """
+    Send sig to ffmpeg's process group (it leads its own session), or just the process without killpg.
+    """
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass # Already exited
+    except AttributeError:
+        process.send_signal(sig)
 
 def stop_stream_processing():
-    global current_process, current_streamer, current_quality, current_qscale, current_fps
-    if current_process:
-        current_process.terminate()
+    global current_state, start_generation
+    start_generation += 1
+    process = current_state.process if current_state else None
+    if current_state and current_state.source:
+        close_source(current_state.source) # Also ends the feed thread
+    if process:
+        signal_process_group(process, signal.SIGTERM)
         try:
-            current_process.wait(timeout=2)
+            process.wait(timeout=2)
         except subprocess.TimeoutExpired:
-            current_process.kill()
-        current_process = None
-    current_streamer = None
-    current_quality = None
-    current_qscale = None
-    current_fps = None
+            signal_process_group(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+            process.wait()
+    current_state = None
+    publish_frame(b"")
 
 def check_stale_stream():
     """Checks if the frame or process is dead and restarts if needed."""
-    global current_streamer, current_process
-    if not current_streamer:
+    state = current_state
+    if not state:
+        return
+    restart_args = state[:4]
+
+    # Last start attempt failed before ffmpeg launched (e.g. streamer offline); retry once the backoff allows
+    if state.process is None:
+        if time.monotonic() - last_restart_time >= restart_backoff:
+            log.info("Retrying %s (backoff %.0fs)...", state.streamer, restart_backoff)
+            start_stream_processing(*restart_args)
         return
 
     # If process died
-    if current_process and current_process.poll() is not None:
-        print("FFmpeg process died. Restarting...")
-        threading.Thread(
-            target=start_stream_processing, 
-            args=(current_streamer, current_quality, current_qscale, current_fps)
-        ).start()
+    if state.process.poll() is not None:
+        if time.monotonic() - last_restart_time < restart_backoff:
+            return
+        log.info("FFmpeg process died. Restarting...")
+        start_stream_processing(*restart_args)
         return
 
-    # If file is stale (ffmpeg hung)
-    if os.path.exists(FRAME_PATH):
-        age = time.time() - os.path.getmtime(FRAME_PATH)
-        if age > 10: # No new frame for 10 seconds
-            print(f"Frame is stale ({age:.1f}s). Restarting...")
-            threading.Thread(
-                target=start_stream_processing, 
-                args=(current_streamer, current_quality, current_qscale, current_fps)
-            ).start()
+    # If frames stopped arriving (ffmpeg hung). A live process counts as "already running" to
+    # start_stream_processing, so kill it; the dead-process branch restarts it with backoff.
+    data, frame_ts, _ = get_latest_frame()
+    if data:
+        age = time.monotonic() - frame_ts
+        if age > FRAME_STALE_SECONDS:
+            log.info("Frame is stale (%.1fs). Restarting...", age)
+            signal_process_group(state.process, getattr(signal, "SIGKILL", signal.SIGTERM))
     else:
-        # File doesn't exist but we think we are streaming?
-        if current_process and (time.time() - last_restart_time > 15):
-             print("Frame file missing. Restarting...")
-             threading.Thread(
-                target=start_stream_processing, 
-                args=(current_streamer, current_quality, current_qscale, current_fps)
-            ).start()
+        # No frame yet but we think we are streaming?
+        if time.monotonic() - last_restart_time > max(15, restart_backoff):
+            log.info("No frames received. Restarting...")
+            signal_process_group(state.process, getattr(signal, "SIGKILL", signal.SIGTERM))
+
+def request_stream(*args):
+    """
+    Ask the supervisor to switch to this selection; returns at once instead of waiting on ffmpeg.
+    """
+    start_requests.put(args)
+    supervisor_wake.set()
+
+def supervise_stream():
+    """
+    Single background thread that owns ffmpeg starts and restarts, so request handlers only serve bytes.
+    """
+    while True:
+        try:
+            # Only the newest of any queued selections matters
+            selection = None
+            while not start_requests.empty():
+                selection = start_requests.get_nowait()
+            if selection:
+                start_stream_processing(*selection)
+            else:
+                check_stale_stream()
+        except Exception as e:
+            log.error("Stream supervisor error: %s", e)
+        supervisor_wake.wait(1)
+        supervisor_wake.clear()
 
 def mjpeg_generator():
     """
-    Stream the latest JPEG as a multipart/x-mixed-replace stream.
+    Push each new frame as a part of a multipart/x-mixed-replace stream.
     """
-    boundary = b"--frame"
-    min_interval = max(0.05, 1.0 / max(1.0, FRAME_FPS * 1.5)) 
+    last_version = None
+    last_sent = 0.0  # Monotonic time of the last part; 0 sends the placeholder at once if no frame is up yet
     while True:
         try:
-            check_stale_stream()
-            if os.path.exists(FRAME_PATH):
-                with open(FRAME_PATH, "rb") as f:
-                    data = f.read()
+            data, version = wait_for_frame(last_version, 2.0)
+            if version != last_version:
+                # Track empty publishes too (no frame yet, or a stop), or the wait returns at once forever
+                last_version = version
+                if data:
+                    last_sent = time.monotonic()
+                    # One buffer per frame so the server issues a single send() for header + image
+                    yield (MJPEG_PART_HEADER % len(data)) + data + b"\r\n"
+                    continue
+            if time.monotonic() - last_sent >= MJPEG_KEEPALIVE_SECONDS:
+                # Nothing new (streamer offline, restart backoff, stopped): re-send the current frame or
+                # the placeholder, so a vanished client's write fails and releases this worker thread
+                last_sent = time.monotonic()
                 if data:
-                    yield boundary + b"\r\n"
-                    yield b"Content-Type: image/jpeg\r\n"
-                    yield b"Cache-Control: no-store, no-cache, must-revalidate\r\n"
-                    yield b"Pragma: no-cache\r\n"
-                    yield f"Content-Length: {len(data)}\r\n\r\n".encode("ascii")
-                    yield data + b"\r\n"
-            time.sleep(min_interval)
+                    yield (MJPEG_PART_HEADER % len(data)) + data + b"\r\n"
+                else:
+                    placeholder, mimetype = get_placeholder()
+                    yield (
+                        b"--frame\r\nContent-Type: " + mimetype.encode("ascii")
+                        + b"\r\nContent-Length: %d\r\n\r\n" % len(placeholder) + placeholder + b"\r\n"
+                    )
         except GeneratorExit:
             break
         except Exception as e:
-            print(f"mjpeg stream error: {e}")
+            log.warning("mjpeg stream error: %s", e)
             time.sleep(0.5)
 
 # Templates
@@ -374,7 +1034,7 @@ INDEX_HTML = """
 </head>
 <body>
     <h1>Twitch: {{ category }}</h1>
-    <a href="/" class="refresh-btn">Refresh List</a>
+    <a href="/?refresh=1" class="refresh-btn">Refresh List</a>
     <ul class="stream-list">
         {% for stream in streams %}
         <li class="stream-item">
@@ -401,15 +1061,21 @@ VIEW_HTML = """
     <meta http-equiv="Pragma" content="no-cache">
     <meta http-equiv="Expires" content="0">
     
+    {% if mode == "poll" %}
     <!-- No-JS Fallback -->
     <noscript>
         <meta http-equiv="refresh" content="{{ refresh_seconds }};url={{ request.url }}">
     </noscript>
+    {% endif %}
 
     <style>
         body { margin: 0; padding: 0; background: #fff; text-align: center; height: 100vh; display: flex; flex-direction: column; }
         #stream-container { flex: 1; display: flex; align-items: center; justify-content: center; overflow: hidden; }
         img { max-width: 100%; max-height: 100%; object-fit: contain; filter: grayscale(100%); }
+        {% if css_rotate %}
+        /* Frames arrive landscape; turn them here. Limits apply before the turn, so they use swapped axes. */
+        #stream-frame { max-width: 100vh; max-height: 100vw; -webkit-transform: rotate({{ css_rotate }}deg); transform: rotate({{ css_rotate }}deg); }
+        {% endif %}
         .controls { padding: 10px; border-top: 1px solid #000; }
         a { text-decoration: none; color: #000; border: 1px solid #000; padding: 5px 15px; }
         select { padding: 5px; margin-right: 10px; }
@@ -423,20 +1089,45 @@ VIEW_HTML = """
         {% endif %}
     </style>
     <script>
-        {% if autoplay %}
+        {% if autoplay and mode == "poll" %}
         (function() {
             var refreshMs = {{ refresh_ms }};
             var isKobo = {{ is_kobo|tojson }};
             var displayImg = null;
             var loading = false;
             var loadTimeout = null;
+            var version = {{ frame_version|tojson }}; // Version of the frame the page was rendered with
+            var waitSeconds = Math.max(1, refreshMs / 1000);
+            var checkStarted = 0;
             
-            function updateImage() {
+            // Long-poll: the server answers as soon as a frame newer than ours lands (or after
+            // waitSeconds), so a changed frame costs one image download right behind the answer.
+            function checkVersion() {
+                checkStarted = Date.now();
+                var xhr = new XMLHttpRequest();
+                xhr.open('GET', '/frame_wait?timeout=' + waitSeconds + (version === null ? '' : '&v=' + version), true);
+                xhr.onreadystatechange = function() {
+                    if (xhr.readyState !== 4) return;
+                    var next = null;
+                    try { next = JSON.parse(xhr.responseText).version; } catch (e) {}
+                    if (next === null) {
+                        // Version check failed; fetch the frame anyway so the page keeps moving
+                        updateImage(Date.now());
+                    } else if (next !== version) {
+                        version = next;
+                        updateImage(next);
+                    } else {
+                        scheduleNext();
+                    }
+                };
+                xhr.send();
+            }
+            
+            function updateImage(key) {
                 if (loading) return;
                 loading = true;
                 
                 var temp = new Image();
-                var unique = Date.now();
                 
                 loadTimeout = setTimeout(function() {
                     console.warn("Image load timed out");
@@ -459,7 +1150,7 @@ VIEW_HTML = """
                     scheduleNext();
                 };
                 
-                temp.src = '/frame.jpg?t=' + unique;
+                temp.src = '/frame.jpg?v=' + key;
                 
                 function cleanup() {
                     loading = false;
@@ -473,13 +1164,14 @@ VIEW_HTML = """
                 }
             }
             
+            // At most one check per refreshMs: a long-poll that already waited that long goes again at once
             function scheduleNext() {
-                setTimeout(updateImage, refreshMs);
+                setTimeout(checkVersion, Math.max(0, checkStarted + refreshMs - Date.now()));
             }
             
             window.onload = function() {
                 displayImg = document.getElementById('stream-frame');
-                updateImage();
+                checkVersion();
             };
         })();
         {% endif %}
@@ -487,8 +1179,10 @@ VIEW_HTML = """
 </head>
 <body>
     <div id="stream-container">
-        {% if autoplay %}
-        <img id="stream-frame" src="/frame.jpg?t={{ now }}" alt="Stream">
+        {% if autoplay and mode == "mjpeg" %}
+        <img id="stream-frame" src="/stream.mjpg?t={{ now }}" alt="Stream">
+        {% elif autoplay %}
+        <img id="stream-frame" src="{{ frame_src }}" alt="Stream">
         {% else %}
         <div class="hint">Select a quality below to start streaming.</div>
         {% endif %}
@@ -519,6 +1213,14 @@ VIEW_HTML = """
                     {% endfor %}
                 </select>
             </div>
+            <div>
+                <label for="mode">Mode:</label>
+                <select name="mode" id="mode" onchange="this.form.submit()">
+                    {% for mv, mlabel in mode_options %}
+                    <option value="{{ mv }}" {% if mv == mode %}selected{% endif %}>{{ mlabel }}</option>
+                    {% endfor %}
+                </select>
+            </div>
             <noscript><button type="submit">Apply</button></noscript>
         </form>
         <a href="/">Back to List</a>
@@ -529,17 +1231,78 @@ VIEW_HTML = """
 </html>
 """
 
+# Response headers shared by every handler. Pages, placeholders and the push stream must never be
+# cached; real frames may be kept but are revalidated against their ETag on every poll.
+# Cache-Control alone: HTTP/1.1 clients ignore Pragma and Expires next to it, and these go out on every poll.
+NO_STORE_HEADERS = {
+    "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
+}
+REVALIDATE_HEADERS = {
+    "Cache-Control": "no-cache, must-revalidate, max-age=0",
+}
+
+# Compile the templates once at import instead of on every request. Flask's environment keeps
+# HTML autoescaping on for stream titles.
+INDEX_TEMPLATE = app.jinja_env.from_string(INDEX_HTML)
+VIEW_TEMPLATE = app.jinja_env.from_string(VIEW_HTML)
+
+# Frames up to this size are embedded in poll-mode pages as data: URIs (base64 adds a third)
+INLINE_FRAME_MAX_BYTES = 150_000
+
+# Viewer form choices; fixed for the life of the process.
+# The configured default quality and common fallbacks are always offered (deduped once here).
+BASELINE_QUALITIES = tuple(dict.fromkeys([
+    TWITCH_STREAM_QUALITY,
+    "source",
+    "1080p60",
+    "1080p",
+    "720p60",
+    "720p",
+    "480p",
+    "360p",
+    "worst",
+]))
+MODE_OPTIONS = [
+    ("mjpeg", "Push (MJPEG)"),
+    ("poll", "Poll (JPEG)"),
+]
+IMAGE_QUALITY_OPTIONS = [
+    (1, "HQ (q=1)"),
+    (2, "High (q=2)"),
+    (4, "Medium (q=4)"),
+    (8, "Light (q=8)"),
+]
+FPS_OPTIONS = [
+    (0.5, "0.5 fps (very slow)"),
+    (1.0, "1 fps (slow)"),
+    (1.5, "1.5 fps (default)"),
+    (2.0, "2 fps"),
+    (3.0, "3 fps"),
+    (4.0, "4 fps (faster)"),
+]
+
+# Longest /?refresh=1 waits for the background poller before rendering the snapshot it has
+INDEX_REFRESH_WAIT = 1.5
+
 @app.route('/')
 def index():
     category = TWITCH_CATEGORY
-    streams = twitch_api.get_streams(category)
-    return render_template_string(INDEX_HTML, streams=streams, category=category)
+    if request.args.get("refresh"):
+        # Explicit ?refresh=1: give the poller a moment to fetch a fresh listing; if Twitch is slow,
+        # render the current snapshot rather than hold the request on the API
+        streams_cache.wait_for_refresh(INDEX_REFRESH_WAIT)
+    streams = streams_cache.get()
+    if not streams:
+        # Empty listing (cold start or Twitch hiccup): fetch again now so a reload shows it
+        streams_cache.request_refresh()
+    return INDEX_TEMPLATE.render(streams=streams, category=category)
 
 @app.route('/view/<streamer>')
 def view(streamer):
     requested_quality = request.args.get("quality")
     requested_imgq = request.args.get("imgq", type=int)
     requested_fps = request.args.get("fps", type=float)
+    requested_mode = request.args.get("mode")
     
     # Kobo detection
     is_kobo = "Kobo" in request.headers.get("User-Agent", "")
@@ -547,18 +1310,10 @@ def view(streamer):
     qualities = get_stream_qualities(streamer)
 
     # Always include the configured default and common fallbacks, and dedupe.
-    baseline_qualities = [
-        TWITCH_STREAM_QUALITY,
-        "source",
-        "1080p60",
-        "1080p",
-        "720p60",
-        "720p",
-        "480p",
-        "360p",
-        "worst",
-    ]
-    qualities = list(dict.fromkeys((qualities or []) + baseline_qualities))
+    if qualities:
+        qualities = list(dict.fromkeys([*qualities, *BASELINE_QUALITIES]))
+    else:
+        qualities = BASELINE_QUALITIES
 
     selected_quality = requested_quality or (qualities[0] if qualities else TWITCH_STREAM_QUALITY)
     selected_imgq = requested_imgq or FRAME_JPEG_QSCALE
@@ -569,20 +1324,13 @@ def view(streamer):
     else:
         selected_fps = requested_fps or FRAME_FPS
 
-    image_quality_options = [
-        (1, "HQ (q=1)"),
-        (2, "High (q=2)"),
-        (4, "Medium (q=4)"),
-        (8, "Light (q=8)"),
-    ]
-    fps_options = [
-        (0.5, "0.5 fps (very slow)"),
-        (1.0, "1 fps (slow)"),
-        (1.5, "1.5 fps (default)"),
-        (2.0, "2 fps"),
-        (3.0, "3 fps"),
-        (4.0, "4 fps (faster)"),
-    ]
+    # Page-flipping via JS polling stays the default on Kobo; everything else gets the push stream.
+    if requested_mode in ("mjpeg", "poll"):
+        mode = requested_mode
+    elif is_kobo:
+        mode = "poll"
+    else:
+        mode = FRAME_MODE if FRAME_MODE in ("mjpeg", "poll") else "mjpeg"
 
     # Clamp refresh interval for Kobo e-ink; tie it loosely to selected fps.
     refresh_ms = request.args.get("refresh_ms", type=int)
@@ -595,73 +1343,163 @@ def view(streamer):
 
     # Start processing only after the user has picked a quality
     autoplay = requested_quality is not None
+    selection = (streamer, selected_quality, selected_imgq, selected_fps)
+    state = current_state
+    switching = state is None or state[:4] != selection
     if autoplay:
-        start_stream_processing(streamer, selected_quality, selected_imgq, selected_fps)
+        request_stream(*selection)
 
-    resp = make_response(
-        render_template_string(
-            VIEW_HTML,
+    # Poll pages (and the no-JS meta refresh on Kobo) carry the current frame inline, so each
+    # reload paints with one request instead of page + image. Large frames go by a URL naming their
+    # version, and while switching streams the placeholder stands in for the outgoing stream's frame.
+    # The script starts from the rendered version, so it never downloads that frame a second time.
+    frame_src = None
+    frame_version = None
+    if autoplay and mode == "poll":
+        data, _, version = get_latest_frame()
+        if switching:
+            # The current frame belongs to the outgoing stream: show the placeholder until the next one
+            placeholder, mimetype = get_placeholder()
+            frame_src = f"data:{mimetype};base64,{base64.b64encode(placeholder).decode('ascii')}"
+            frame_version = version
+        elif data and len(data) <= INLINE_FRAME_MAX_BYTES:
+            frame_src = f"data:{FRAME_MIMETYPE};base64,{base64.b64encode(data).decode('ascii')}"
+            frame_version = version
+        else:
+            frame_src = f"/frame.jpg?v={version}"
+            frame_version = version
+
+    return Response(
+        VIEW_TEMPLATE.render(
+            request=request,
             streamer=streamer,
             qualities=qualities,
             selected_quality=selected_quality,
-            image_quality_options=image_quality_options,
+            image_quality_options=IMAGE_QUALITY_OPTIONS,
             selected_imgq=selected_imgq,
-            fps_options=fps_options,
+            fps_options=FPS_OPTIONS,
             selected_fps=selected_fps,
+            mode_options=MODE_OPTIONS,
+            mode=mode,
             refresh_ms=refresh_ms,
             refresh_seconds=refresh_ms / 1000.0,
             is_kobo=is_kobo,
             now=time.time(),
+            frame_src=frame_src,
+            frame_version=frame_version,
+            css_rotate=CSS_ROTATE_DEGREES,
             autoplay=autoplay,
-        )
+        ),
+        mimetype="text/html",
+        headers=NO_STORE_HEADERS,
     )
-    resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-    resp.headers["Pragma"] = "no-cache"
-    resp.headers["Expires"] = "0"
-    return resp
 
 @app.route('/frame.jpg')
 def frame():
-    check_stale_stream()
-    
-    # If the file exists, serve it.
-    if os.path.exists(FRAME_PATH):
-        resp = send_file(FRAME_PATH, mimetype='image/jpeg')
-        # Kobo / embedded browsers can be aggressive about caching; force a fresh fetch.
-        resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-        resp.headers["Pragma"] = "no-cache"
-        resp.headers["Expires"] = "0"
+    # Serve the newest frame straight from memory.
+    data, _, version = get_latest_frame()
+    if data:
+        # The frame version is the validator: repeat polls of an unchanged frame get an empty 304.
+        etag = f'"{version}"'
+        # Kobo / embedded browsers can be aggressive about caching; always revalidate.
+        if request.headers.get("If-None-Match") == etag:
+            resp = Response(status=304, headers=REVALIDATE_HEADERS)
+        else:
+            resp = Response(data, mimetype=FRAME_MIMETYPE, headers=REVALIDATE_HEADERS)
+        resp.headers["ETag"] = etag
         return resp
-    else:
-        return "Loading...", 404
+
+    # No frame yet: a real image keeps the poll loop on its normal cadence instead of the onerror path.
+    placeholder, mimetype = get_placeholder()
+    return Response(placeholder, mimetype=mimetype, headers=NO_STORE_HEADERS)
+
+@app.route('/frame_wait')
+def frame_wait():
+    """
+    Long-poll for clients that want to fetch /frame.jpg only when it changed: blocks until the
+    frame version differs from ?v= (or ?timeout= seconds pass) and returns the current version.
+    """
+    since = request.args.get("v", type=int)
+    timeout = max(0.0, min(request.args.get("timeout", 10.0, type=float), 30.0))
+    _, version = wait_for_frame(since, timeout)
+    return jsonify({"version": version}), 200, NO_STORE_HEADERS
+
+# Slack on top of the stream supervisor's own restart deadlines before /health reports failure
+HEALTH_GRACE_SECONDS = 20
 
 @app.route('/health')
 def health():
-    return "OK", 200
+    """
+    Pipeline liveness for external supervisors. Only a pipeline the stream supervisor has failed to
+    recover answers 503; an offline streamer waiting out its restart backoff is healthy.
+    """
+    state = current_state
+    process = state.process if state else None
+    running = bool(process and process.poll() is None)
+    data, frame_ts, version = get_latest_frame()
+    now = time.monotonic()
+    frame_age = now - frame_ts if data else None
+    since_start = now - last_restart_time
+    if state is None:
+        status, ok = "idle", True
+    elif not running:
+        # Lookup failed (e.g. streamer offline) or ffmpeg exited: the supervisor retries after the backoff
+        status = "waiting" if process is None else "restarting"
+        ok = since_start <= restart_backoff + HEALTH_GRACE_SECONDS
+    elif frame_age is not None:
+        # The supervisor kills ffmpeg once frames are FRAME_STALE_SECONDS old
+        status = "streaming" if frame_age <= FRAME_STALE_SECONDS else "stalled"
+        ok = frame_age <= FRAME_STALE_SECONDS + HEALTH_GRACE_SECONDS
+    else:
+        # Started but no frame yet; the supervisor gives up on it after max(15 s, backoff)
+        status = "starting"
+        ok = since_start <= max(15, restart_backoff) + HEALTH_GRACE_SECONDS
+    body = {
+        "ok": ok,
+        "status": status,
+        "streamer": state.streamer if state else None,
+        "quality": state.quality if state else None,
+        "pid": process.pid if process else None,
+        "running": running,
+        "frame_age_s": round(frame_age, 1) if frame_age is not None else None,
+        "frames": version,
+        "restart_backoff_s": round(restart_backoff, 1),
+    }
+    return jsonify(body), 200 if ok else 503
 
 @app.route('/stream.mjpg')
 def stream_mjpg():
-    # Ensure a stream is running
-    check_stale_stream()
-    
-    headers = {
-        "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
-        "Pragma": "no-cache",
-        "Expires": "0",
-    }
-    return Response(mjpeg_generator(), mimetype="multipart/x-mixed-replace; boundary=frame", headers=headers)
+    return Response(mjpeg_generator(), mimetype="multipart/x-mixed-replace; boundary=frame", headers=NO_STORE_HEADERS)
 
 # Cleanup on exit
-def cleanup(signum, frame):
+def shutdown_stream():
+    """
+    Stop ffmpeg for good. Retiring the generation first fails any start still resolving, and holding
+    stream_lock waits out one already in Popen; the lock is never released, so nothing starts after.
+    """
+    global start_generation
+    start_generation += 1
+    if not stream_lock.acquire(timeout=5):
+        log.warning("Stream lock busy at shutdown; stopping ffmpeg anyway")
     stop_stream_processing()
-    exit(0)
+
+def cleanup(signum, _frame):
+    # Stop ffmpeg, flush queued log records, then exit without unwinding whatever thread the signal
+    # interrupted (SystemExit mid-request can hang the worker until it is SIGKILLed)
+    shutdown_stream()
+    log_listener.stop()
+    os._exit(0)
+
+# Normal interpreter exit skips the signal handler; still take ffmpeg down with us
+atexit.register(shutdown_stream)
 
 signal.signal(signal.SIGINT, cleanup)
 signal.signal(signal.SIGTERM, cleanup)
 
+threading.Thread(target=supervise_stream, daemon=True).start()
+threading.Thread(target=load_placeholder, daemon=True).start()
+streams_cache.start()
+
 if __name__ == '__main__':
-    # Clean start
-    if os.path.exists(FRAME_PATH):
-        os.remove(FRAME_PATH)
-        
-    app.run(host='0.0.0.0', port=PORT)
+    # Local development only; deployments run under gunicorn via start.sh.
+    app.run(host='0.0.0.0', port=PORT, threaded=True)
@@ -9,7 +9,9 @@ if [ -z "$TWITCH_SECRET" ]; then
 fi
 
 # Run with Gunicorn
-# 1 worker is essential because we use global state for the ffmpeg process
+# 1 worker is essential because we use global state for the ffmpeg process.
+# Every open /stream.mjpg viewer holds a thread, so leave headroom for page and frame requests.
+THREADS="${GUNICORN_THREADS:-8}"
 echo "Starting Kobo Twitch Server on port $PORT..."
-exec gunicorn server:app --bind 0.0.0.0:$PORT --workers 1 --threads 4 --timeout 120
+exec gunicorn server:app --bind 0.0.0.0:$PORT --workers 1 --worker-class gthread --threads $THREADS --timeout 120
 